@@ -1,36 +1,379 @@
+import base64
+import contextlib
+import io
+import math
+import os
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
+
+try:
+    import datashader as ds
+    import datashader.transfer_functions as tf
+    from datashader.utils import lnglat_to_meters
+except ImportError:  # Optional: only needed for very large restaurants
+    ds = None
+
+try:
+    import orjson  # noqa: F401
+except ImportError:  # Optional: Plotly falls back to its json encoder
+    pass
+else:
+    pio.json.config.default_engine = "orjson"
+
+try:
+    from pyproj import Geod
+except ImportError:  # Optional: falls back to the haversine kernels
+    _GEOD = None
+else:
+    _GEOD = Geod(ellps="WGS84")
+
+# Numba is only needed for the haversine fallback, so skip it (and its JIT
+# compile) when pyproj handles distances.
+njit = None
+if _GEOD is None:
+    try:
+        from numba import njit, prange
+    except ImportError:  # Optional: falls back to the NumPy haversine
+        pass
+
+
+# -------------------------------------------
+# Vectorized Haversine Distance Calculation
+# -------------------------------------------
+def haversine_vectorized(lat1, lon1, lat2, lon2):
+    R = 6371.0  # Earth radius in km
+    # Convert into one preallocated buffer instead of four new arrays; the
+    # constant matches the input dtype so float32 math never upcasts.
+    deg2rad = lat1.dtype.type(np.pi / 180.0)
+    rad = np.empty((4, lat1.shape[0]), dtype=lat1.dtype)
+    for src, dst in zip((lat1, lon1, lat2, lon2), rad):
+        np.multiply(src, deg2rad, out=dst)
+    lat1, lon1, lat2, lon2 = rad
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return R * c
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def haversine_nb(lat1, lon1, lat2, lon2, out):
+        """Fused haversine kernel writing distances in km into ``out``."""
+        R = 6371.0  # Earth radius in km
+        deg2rad = math.pi / 180.0
+        for i in prange(lat1.shape[0]):
+            phi1 = lat1[i] * deg2rad
+            phi2 = lat2[i] * deg2rad
+            dlat = phi2 - phi1
+            dlon = (lon2[i] - lon1[i]) * deg2rad
+            a = (
+                math.sin(dlat / 2) ** 2
+                + math.cos(phi1) * math.cos(phi2) * math.sin(dlon / 2) ** 2
+            )
+            out[i] = 2 * R * math.asin(math.sqrt(a))
+
+
+def compute_distance_km(lat1, lon1, lat2, lon2):
+    """Distance in km between NumPy coordinate arrays.
+
+    Uses the WGS84 geodesic from pyproj when installed, otherwise the
+    haversine formula (Numba kernel if available, else NumPy).
+    """
+    if _GEOD is not None:
+        _, _, dist_m = _GEOD.inv(lon1, lat1, lon2, lat2)
+        return dist_m / 1000.0
+    if njit is None:
+        return haversine_vectorized(lat1, lon1, lat2, lon2)
+    out = np.empty(lat1.shape[0], dtype=lat1.dtype)
+    haversine_nb(lat1, lon1, lat2, lon2, out)
+    return out
+
+
+# Distance implementation picked by compute_distance_km; part of the on-disk
+# cache name so switching backends never serves distances from another one.
+if _GEOD is not None:
+    DISTANCE_BACKEND = "pyproj"
+elif njit is not None:
+    DISTANCE_BACKEND = "numba"
+else:
+    DISTANCE_BACKEND = "numpy"
+
+
+# -----------------------------
+# Map Trace Helpers
+# -----------------------------
+# Above this many deliveries only this many connection lines (the longest
+# ones) are drawn and the delivery points are sent as grid clusters instead of
+# one marker per order, to keep the map responsive.
+LARGE_RESULT_THRESHOLD = 2000
+
+# Grid cell size in degrees (~500 m) used to cluster delivery points.
+CLUSTER_CELL_DEG = 0.005
+
+
+def _make_cluster_trace(delivery_data, cell=CLUSTER_CELL_DEG):
+    """Aggregate deliveries into grid cells, one marker sized by order count."""
+    cells = pd.DataFrame(
+        {
+            "lat": np.floor(delivery_data["lat"].to_numpy() / cell) * cell + cell / 2,
+            "lon": np.floor(delivery_data["lon"].to_numpy() / cell) * cell + cell / 2,
+        }
+    )
+    clusters = cells.groupby(["lat", "lon"], sort=False).size()
+    counts = clusters.to_numpy()
+    return go.Scattermap(
+        lat=clusters.index.get_level_values("lat").to_numpy(),
+        lon=clusters.index.get_level_values("lon").to_numpy(),
+        mode="markers",
+        marker=dict(
+            symbol="circle", size=np.sqrt(counts) * 4 + 4, color="green", opacity=0.6
+        ),
+        text=counts,
+        hovertemplate="<b>Orders:</b> %{text}<extra></extra>",
+        name="Delivery clusters",
+    )
+
+
+def _build_edges(frame):
+    """Interleave (restaurant, delivery, NaN) triplets; NaN breaks lines like None."""
+    n_edges = len(frame)
+    edge_lat = np.empty(3 * n_edges, dtype=np.float64)
+    edge_lon = np.empty(3 * n_edges, dtype=np.float64)
+    edge_lat[0::3] = frame["Latitude"].to_numpy()
+    edge_lat[1::3] = frame["DeliveryLat"].to_numpy()
+    edge_lat[2::3] = np.nan
+    edge_lon[0::3] = frame["Longitude"].to_numpy()
+    edge_lon[1::3] = frame["DeliveryLong"].to_numpy()
+    edge_lon[2::3] = np.nan
+    return edge_lat, edge_lon
+
+
+# Above this many deliveries the points are rasterized with Datashader into a
+# single image overlay instead of being sent to the browser one by one.
+RASTERIZE_THRESHOLD = 20000
+# Share of points ignored at each edge when sizing the raster, so a few bad
+# coordinates (e.g. 0, 0 placeholders) cannot stretch it over a huge area.
+RASTER_CLIP_QUANTILE = 0.005
+
+
+def _rasterize_deliveries(delivery_data):
+    """Render delivery points to a PNG and return it as a map image layer.
+
+    Points are projected to Web Mercator so the image lines up with the map
+    tiles, and the extent is clipped to quantiles of the valid coordinates.
+    """
+    lon = delivery_data["lon"].to_numpy(np.float64)
+    lat = delivery_data["lat"].to_numpy(np.float64)
+    valid = np.isfinite(lon) & np.isfinite(lat) & (np.abs(lat) < 85)
+    lon, lat = lon[valid], lat[valid]
+    clip = (RASTER_CLIP_QUANTILE, 1 - RASTER_CLIP_QUANTILE)
+    lon_min, lon_max = np.quantile(lon, clip)
+    lat_min, lat_max = np.quantile(lat, clip)
+
+    x, y = lnglat_to_meters(lon, lat)
+    x_min, y_min = lnglat_to_meters(lon_min, lat_min)
+    x_max, y_max = lnglat_to_meters(lon_max, lat_max)
+    cvs = ds.Canvas(
+        plot_width=1024,
+        plot_height=800,
+        x_range=(x_min, x_max),
+        y_range=(y_min, y_max),
+    )
+    agg = cvs.points(pd.DataFrame({"x": x, "y": y}), "x", "y")
+    img = tf.shade(agg, cmap=["lightgreen", "darkgreen"])
+
+    buffer = io.BytesIO()
+    img.to_pil().save(buffer, format="PNG")
+    img_uri = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return dict(
+        sourcetype="image",
+        source=img_uri,
+        coordinates=[
+            [float(lon_min), float(lat_max)],
+            [float(lon_max), float(lat_max)],
+            [float(lon_max), float(lat_min)],
+            [float(lon_min), float(lat_min)],
+        ],
+    )
 
 
 # -----------------------
 # Data Loading with Cache
 # -----------------------
-@st.cache_data
-def load_data():
-    restaurants = pd.read_csv("restaurants_lat_long.csv").dropna(axis=1, how="all")
-    orders = pd.read_csv("order_data.csv").dropna(axis=1, how="all")
-    merged_df = pd.merge(
-        orders, restaurants, left_on="BranchId", right_on="id", how="inner"
+# Only the columns the app uses are read from either CSV.
+USED_COLUMNS = {
+    "id",
+    "Latitude",
+    "Longitude",
+    "Name",
+    "ZoneName",
+    "primaryrestautantname",
+    "BranchId",
+    "OrderId",
+    "DeliveryLat",
+    "DeliveryLong",
+    "order_date",
+}
+COORDINATE_DTYPES = {
+    "Latitude": "float64",
+    "Longitude": "float64",
+    "DeliveryLat": "float64",
+    "DeliveryLong": "float64",
+}
+RESTAURANTS_CSV = "restaurants_lat_long.csv"
+ORDERS_CSV = "order_data.csv"
+# On-disk copy of the merged frame, reused across restarts while it is newer
+# than both CSVs. Bump MERGED_SCHEMA_VERSION whenever _build_merged changes how
+# columns are derived so older files are ignored.
+MERGED_SCHEMA_VERSION = 1
+MERGED_CACHE = f"merged-v{MERGED_SCHEMA_VERSION}-{DISTANCE_BACKEND}.parquet"
+
+
+def _data_version():
+    """Latest modification time of the source CSVs, used as a cache key."""
+    return max(os.path.getmtime(RESTAURANTS_CSV), os.path.getmtime(ORDERS_CSV))
+
+
+# The loaders below use st.cache_resource so cache hits hand back the same
+# read-only objects instead of copying large frames; callers must not mutate
+# them. Persistence across restarts comes from MERGED_CACHE. Only the current
+# data version is kept, so older frames are released after a CSV change.
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_data(data_version):
+    if os.path.exists(MERGED_CACHE) and os.path.getmtime(MERGED_CACHE) > data_version:
+        try:
+            return pd.read_parquet(MERGED_CACHE)
+        except (ImportError, OSError, ValueError):  # Unreadable; rebuild it
+            pass
+
+    merged_df = _build_merged()
+    _write_merged_cache(merged_df)
+    return merged_df
+
+
+def _write_merged_cache(merged_df):
+    """Atomically write MERGED_CACHE; failures only cost the on-disk cache."""
+    tmp_path = f"{MERGED_CACHE}.{os.getpid()}.tmp"
+    try:
+        merged_df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, MERGED_CACHE)
+    except (ImportError, OSError):  # No parquet engine or unwritable directory
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+
+
+def _build_merged():
+    restaurants = pd.read_csv(
+        RESTAURANTS_CSV,
+        usecols=lambda col: col in USED_COLUMNS,
+        dtype=COORDINATE_DTYPES,
     )
+    orders = pd.read_csv(
+        ORDERS_CSV,
+        usecols=lambda col: col in USED_COLUMNS,
+        dtype=COORDINATE_DTYPES,
+    )
+    # Parse dates once here (ISO format, cached per unique string).
+    orders["order_date"] = pd.to_datetime(
+        orders["order_date"], format="ISO8601", errors="coerce", cache=True
+    )
+    # Restaurant ids are unique, so an index join avoids hashing both frames.
+    merged_df = orders.join(restaurants.set_index("id"), on="BranchId", how="inner")
+    # Repeated strings become small integer codes, making filters cheap.
+    for col in ["ZoneName", "primaryrestautantname", "Name"]:
+        merged_df[col] = merged_df[col].astype("category")
+    # Distances are computed once for every order instead of on each click.
+    # For the haversine kernels float32 is ample for km distances rounded to
+    # 2 decimals and halves the bytes moved; pyproj works in float64 anyway,
+    # so it gets float64 directly rather than an extra conversion.
+    coord_dtype = np.float64 if _GEOD is not None else np.float32
+    merged_df["distance_km"] = compute_distance_km(
+        merged_df["Latitude"].to_numpy(coord_dtype),
+        merged_df["Longitude"].to_numpy(coord_dtype),
+        merged_df["DeliveryLat"].to_numpy(coord_dtype),
+        merged_df["DeliveryLong"].to_numpy(coord_dtype),
+    ).round(2)
     return merged_df
 
 
-df = load_data()
+# Columns the "Show Relation" view actually consumes.
+GROUP_COLUMNS = [
+    "Latitude",
+    "Longitude",
+    "DeliveryLat",
+    "DeliveryLong",
+    "Name",
+    "OrderId",
+    "order_date",
+    "distance_km",
+]
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load_groups(data_version):
+    """Split the merged orders by (zone, restaurant) once per data version."""
+    return {
+        key: sub[GROUP_COLUMNS].reset_index(drop=True)
+        for key, sub in load_data(data_version).groupby(
+            ["ZoneName", "primaryrestautantname"], sort=False, observed=True
+        )
+    }
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _restaurants_per_zone(data_version):
+    """Sorted restaurant names for each zone, taken from the precomputed groups."""
+    per_zone = {}
+    for zone, restaurant in _load_groups(data_version):
+        per_zone.setdefault(zone, []).append(restaurant)
+    return {zone: sorted(names) for zone, names in per_zone.items()}
+
+
+# Number of recently viewed restaurants whose groups and edges stay cached.
+GROUP_CACHE_SIZE = 32
+
+
+@st.cache_resource(show_spinner=False, max_entries=GROUP_CACHE_SIZE)
+def get_group(data_version, zone, restaurant):
+    """Return the orders for one zone/restaurant and its connection-line arrays.
+
+    Large results only get lines for their longest deliveries, the outliers
+    that remain informative once thousands of lines overlap.
+    """
+    group = _load_groups(data_version).get((zone, restaurant))
+    if group is None:
+        return load_data(data_version)[GROUP_COLUMNS].iloc[0:0], None, None
+    edges = group
+    if len(group) > LARGE_RESULT_THRESHOLD:
+        # Missing distances rank last instead of counting as the longest.
+        distance = np.nan_to_num(group["distance_km"].to_numpy(), nan=-np.inf)
+        longest = np.argpartition(distance, -LARGE_RESULT_THRESHOLD)
+        edges = group.iloc[longest[-LARGE_RESULT_THRESHOLD:]]
+    edge_lat, edge_lon = _build_edges(edges)
+    return group, edge_lat, edge_lon
+
+
+data_version = _data_version()
 
 st.title("Restaurant wise Delivery Points")
 
 # -----------------------------
 # Sidebar: Zone and Restaurant Filters
 # -----------------------------
-zones = sorted(df["ZoneName"].unique())
+# Zones and their restaurants come from the same precomputed groups, so every
+# listed zone has at least one restaurant to choose.
+zones = sorted(_restaurants_per_zone(data_version))
 zone_options = ["Select Zone"] + zones
 selected_zone = st.sidebar.selectbox("Select Zone Name", options=zone_options)
 
 if selected_zone != "Select Zone":
-    df_zone = df[df["ZoneName"] == selected_zone]
-    restaurants_in_zone = sorted(df_zone["primaryrestautantname"].unique())
+    restaurants_in_zone = _restaurants_per_zone(data_version)[selected_zone]
     restaurant_options = ["Select Restaurant"] + restaurants_in_zone
     selected_restaurant = st.sidebar.selectbox(
         "Select Restaurant", options=restaurant_options
@@ -46,48 +389,27 @@ if (selected_zone != "Select Zone") and (
         # ----------------------------
         # Filter Data Based on Selections
         # ----------------------------
-        filtered_df = df[
-            (df["ZoneName"] == selected_zone)
-            & (df["primaryrestautantname"] == selected_restaurant)
-        ]
+        filtered_df, edge_lat, edge_lon = get_group(
+            data_version, selected_zone, selected_restaurant
+        )
         if filtered_df.empty:
             st.warning("No data available for the selected filters.")
         else:
-            # -------------------------------------------
-            # Vectorized Haversine Distance Calculation
-            # -------------------------------------------
-            def haversine_vectorized(lat1, lon1, lat2, lon2):
-                R = 6371.0  # Earth radius in km
-                lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-                dlat = lat2 - lat1
-                dlon = lon2 - lon1
-                a = (
-                    np.sin(dlat / 2) ** 2
-                    + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
-                )
-                c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-                return R * c
-
-            filtered_df = filtered_df.copy()  # Avoid SettingWithCopyWarning
-            filtered_df["distance_km"] = haversine_vectorized(
-                filtered_df["Latitude"],
-                filtered_df["Longitude"],
-                filtered_df["DeliveryLat"],
-                filtered_df["DeliveryLong"],
-            ).round(2)
-
             # -------------------------------------------
             # Prepare Data for Map Visualization
             # -------------------------------------------
-            # Restaurant data: location and name.
-            restaurant_data = filtered_df[
-                ["Latitude", "Longitude", "Name", "ZoneName"]
-            ].rename(
-                columns={
-                    "Latitude": "lat",
-                    "Longitude": "lon",
-                    "Name": "restaurant_name",
-                }
+            # Restaurant data: location and name, one row since every order
+            # repeats the same restaurant.
+            restaurant_data = (
+                filtered_df[["Latitude", "Longitude", "Name"]]
+                .iloc[[0]]
+                .rename(
+                    columns={
+                        "Latitude": "lat",
+                        "Longitude": "lon",
+                        "Name": "restaurant_name",
+                    }
+                )
             )
 
             # Delivery data: includes order id, order date, and computed distance.
@@ -101,12 +423,8 @@ if (selected_zone != "Select Zone") and (
                 }
             )
 
-            # Build a single trace for connection lines
-            edge_lat = []
-            edge_lon = []
-            for _, row in filtered_df.iterrows():
-                edge_lat.extend([row["Latitude"], row["DeliveryLat"], None])
-                edge_lon.extend([row["Longitude"], row["DeliveryLong"], None])
+            # Build a single trace for connection lines (thinned for large
+            # results in get_group).
             edge_trace = go.Scattermap(
                 lat=edge_lat,
                 lon=edge_lon,
@@ -137,34 +455,47 @@ if (selected_zone != "Select Zone") and (
                 )
             )
 
-            # Delivery Marker (circle marker with order details on hover)
-            fig.add_trace(
-                go.Scattermap(
-                    lat=delivery_data["lat"],
-                    lon=delivery_data["lon"],
-                    mode="markers",
-                    marker=dict(symbol="circle", size=10, color="green"),
-                    text=delivery_data["order_id"],
-                    customdata=np.stack(
-                        (
-                            delivery_data["order_date"].astype(str),
-                            delivery_data["distance_km"].astype(str),
+            # Delivery Marker (circle marker with order details on hover);
+            # large results are sent as grid clusters (order count on hover),
+            # and very large ones as a Datashader image layer instead.
+            rasterize = ds is not None and len(delivery_data) > RASTERIZE_THRESHOLD
+            map_layers = []
+            if rasterize:
+                map_layers.append(_rasterize_deliveries(delivery_data))
+            elif len(delivery_data) > LARGE_RESULT_THRESHOLD:
+                fig.add_trace(_make_cluster_trace(delivery_data))
+            else:
+                fig.add_trace(
+                    go.Scattermap(
+                        lat=delivery_data["lat"].to_numpy(),
+                        lon=delivery_data["lon"].to_numpy(),
+                        mode="markers",
+                        marker=dict(symbol="circle", size=10, color="green"),
+                        text=delivery_data["order_id"],
+                        customdata=np.column_stack(
+                            (
+                                delivery_data["order_date"]
+                                .dt.strftime("%Y-%m-%d")
+                                .fillna("")
+                                .to_numpy(),
+                                np.char.mod(
+                                    "%.2f", delivery_data["distance_km"].to_numpy()
+                                ),
+                            )
                         ),
-                        axis=-1,
-                    ),
-                    hovertemplate=(
-                        "<b>Order ID:</b> %{text}<br>"
-                        + "<b>Date:</b> %{customdata[0]}<br>"
-                        + "<b>Distance:</b> %{customdata[1]} km<extra></extra>"
-                    ),
-                    name="Delivery",
+                        hovertemplate=(
+                            "<b>Order ID:</b> %{text}<br>"
+                            + "<b>Date:</b> %{customdata[0]}<br>"
+                            + "<b>Distance:</b> %{customdata[1]} km<extra></extra>"
+                        ),
+                        name="Delivery",
+                    )
                 )
-            )
 
 
-            # Center the map on the restaurant's location
-            center_lat = restaurant_data["lat"].mean()
-            center_lon = restaurant_data["lon"].mean()
+            # Center the map on the restaurant's location (same on every row)
+            center_lat = filtered_df["Latitude"].iat[0]
+            center_lon = filtered_df["Longitude"].iat[0]
 
             # Update layout using the new 'map' property with an open-street-map style
             fig.update_layout(
@@ -172,6 +503,7 @@ if (selected_zone != "Select Zone") and (
                     style="open-street-map",
                     center=dict(lat=center_lat, lon=center_lon),
                     zoom=12,
+                    layers=map_layers,
                 ),
                 margin={"r": 0, "t": 30, "l": 0, "b": 0},
                 height=800,
@@ -187,15 +519,12 @@ if (selected_zone != "Select Zone") and (
             # -------------------------------------------------
             # Restaurant Summary & Daily Order Trends Summary
             # -------------------------------------------------
-            # Convert order_date to datetime and group by date
-            filtered_df["order_date"] = pd.to_datetime(
-                filtered_df["order_date"], errors="coerce"
-            )
-            daily_orders = (
-                filtered_df.groupby(filtered_df["order_date"].dt.date)
-                .size()
-                .reset_index(name="orders")
-            )
+            # order_date is already parsed to datetime64 in load_data
+            # Bucket by calendar day on datetime64[D] values (no Python dates).
+            order_days = filtered_df["order_date"].to_numpy("datetime64[D]")
+            order_days = order_days[~np.isnat(order_days)]
+            days, counts = np.unique(order_days, return_counts=True)
+            daily_orders = pd.DataFrame({"order_date": days, "orders": counts})
             avg_daily_orders = (
                 daily_orders["orders"].mean() if not daily_orders.empty else 0
             )